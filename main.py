@@ -1,7 +1,9 @@
 # bot.py
 import os
+import asyncio
 import logging
-from secrets import choice as secure_choice
+from functools import lru_cache
+from html import escape
 from string import ascii_lowercase, ascii_uppercase, digits, punctuation
 
 from telegram import (
@@ -16,6 +18,7 @@ from telegram.ext import (
     CommandHandler,
     ContextTypes,
     CallbackQueryHandler,
+    PicklePersistence,
 )
 
 logging.basicConfig(
@@ -24,141 +27,249 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-TOKEN = os.getenv("TG_BOT_TOKEN")
-if not TOKEN:
-    raise SystemExit("Error: TG_BOT_TOKEN not found in env.")
 
-USER = {}  # simple storage
+@lru_cache(maxsize=1)
+def get_token():
+    # read and checked once, at startup rather than on import
+    token = os.getenv("TG_BOT_TOKEN")
+    if not token:
+        raise SystemExit("Error: TG_BOT_TOKEN not found in env.")
+    return token
 
 
-def settings_of(user_id):
-    if user_id not in USER:
-        USER[user_id] = {
-            "length": 12,
-            "upper": True,
-            "lower": True,
-            "digits": True,
-            "symbols": False,
-            "last": None,
-        }
-    return USER[user_id]
+STATE_FILE = "bot_state.pickle"  # user_data survives restarts
 
+SYMBOLS = "".join(ch for ch in punctuation if ch not in ('`', ' ', '´'))
+
+LENGTHS = (8, 12, 16)
+
+BIT_UPPER, BIT_LOWER, BIT_DIGITS, BIT_SYMBOLS = 8, 4, 2, 1
+TOGGLES = {
+    "upper": BIT_UPPER,
+    "lower": BIT_LOWER,
+    "digits": BIT_DIGITS,
+    "symbols": BIT_SYMBOLS,
+}
+
+CHARSETS = (
+    (BIT_LOWER, ascii_lowercase),
+    (BIT_UPPER, ascii_uppercase),
+    (BIT_DIGITS, digits),
+    (BIT_SYMBOLS, SYMBOLS),
+)
+POOLS = {
+    flags: "".join(cs for bit, cs in CHARSETS if flags & bit)
+    for flags in range(16)
+}
+
+
+class Settings:
+    __slots__ = ("length", "flags", "last")
+
+    def __init__(self):
+        self.length = 12
+        self.flags = BIT_UPPER | BIT_LOWER | BIT_DIGITS
+        self.last = None
+
+    # only preferences are persisted; generated passwords never hit disk
+    def __getstate__(self):
+        return self.length, self.flags
+
+    def __setstate__(self, state):
+        self.length, self.flags = state
+        self.last = None
+
+
+def settings_of(user_data):
+    s = user_data.get("settings")
+    if s is None:
+        s = user_data["settings"] = Settings()
+    return s
+
+
+def panel_state(s):
+    return s.length, s.flags
+
+
+def _button(label, on, data):
+    return InlineKeyboardButton(f"{'✅' if on else '⬜️'} {label}", callback_data=data)
+
+
+# each button state exists once and is shared by every prebuilt markup
+LEN_BUTTONS = {
+    (length, on): _button(length, on, f"len:{length}")
+    for length in LENGTHS
+    for on in (True, False)
+}
+TOGGLE_BUTTONS = {
+    (name, on): _button(name.capitalize(), on, f"toggle:{name}")
+    for name in TOGGLES
+    for on in (True, False)
+}
+ACTION_ROW = [
+    InlineKeyboardButton("🔁 Generate", callback_data="do:gen"),
+    InlineKeyboardButton("♻️ Again", callback_data="do:regen"),
+]
+
+
+def _build_keyboard(length, flags):
+    def toggle(name):
+        return TOGGLE_BUTTONS[(name, bool(flags & TOGGLES[name]))]
 
-def keyboard(settings):
     return InlineKeyboardMarkup([
-        [
-            InlineKeyboardButton(
-                f"{'✅' if settings['length']==8 else '⬜️'} 8", callback_data="len:8"
-            ),
-            InlineKeyboardButton(
-                f"{'✅' if settings['length']==12 else '⬜️'} 12", callback_data="len:12"
-            ),
-            InlineKeyboardButton(
-                f"{'✅' if settings['length']==16 else '⬜️'} 16", callback_data="len:16"
-            ),
-        ],
-        [
-            InlineKeyboardButton(
-                f"{'✅' if settings['upper'] else '⬜️'} Upper", callback_data="toggle:upper"
-            ),
-            InlineKeyboardButton(
-                f"{'✅' if settings['lower'] else '⬜️'} Lower", callback_data="toggle:lower"
-            ),
-        ],
-        [
-            InlineKeyboardButton(
-                f"{'✅' if settings['digits'] else '⬜️'} Digits", callback_data="toggle:digits"
-            ),
-            InlineKeyboardButton(
-                f"{'✅' if settings['symbols'] else '⬜️'} Symbols", callback_data="toggle:symbols"
-            ),
-        ],
-        [
-            InlineKeyboardButton("🔁 Generate", callback_data="do:gen"),
-            InlineKeyboardButton("♻️ Again", callback_data="do:regen"),
-        ],
+        [LEN_BUTTONS[(l, l == length)] for l in LENGTHS],
+        [toggle("upper"), toggle("lower")],
+        [toggle("digits"), toggle("symbols")],
+        ACTION_ROW,
     ])
 
 
-def pw_gen(length, u, l, d, s):
-    pool = ""
-    if l:
-        pool += ascii_lowercase
-    if u:
-        pool += ascii_uppercase
-    if d:
-        pool += digits
-    if s:
-        pool += "".join(ch for ch in punctuation if ch not in ('`', ' ', '´'))
+# every (length, flags) panel is built once at import; markups are shared
+# between messages, never mutate them
+KEYBOARDS = {
+    (length, flags): _build_keyboard(length, flags)
+    for length in LENGTHS
+    for flags in range(16)
+}
+
+
+def keyboard(settings):
+    return KEYBOARDS[panel_state(settings)]
+
+
+def pw_gen(length, flags):
+    pool = POOLS[flags]
 
     if not pool:
         return "Enable at least one charset."
 
-    return "".join(secure_choice(pool) for _ in range(length))
+    return _draw(pool, length)
+
+
+@lru_cache(maxsize=16)
+def _table(pool):
+    # byte -> pool char for b < limit; bytes >= limit get deleted (rejected)
+    n = len(pool)
+    limit = 256 - 256 % n
+    table = bytes(ord(pool[b % n]) for b in range(limit)) + bytes(256 - limit)
+    return table, bytes(range(limit, 256))
+
+
+def _draw(pool, length):
+    # translate() does the rejection sampling and mapping in C
+    table, reject = _table(pool)
+    out = os.urandom(int(length * 1.4) + 8).translate(table, reject)
+    while len(out) < length:
+        out += os.urandom(length - len(out) + 8).translate(table, reject)
+    return out[:length].decode("ascii")
+
+
+STATUS_TMPL = (
+    "🔐 <b>Password Generator</b>\n\n"
+    "<b>Length:</b> {length}\n"
+    "<b>Upper:</b> {upper}\n"
+    "<b>Lower:</b> {lower}\n"
+    "<b>Digits:</b> {digits}\n"
+    "<b>Symbols:</b> {symbols}\n\n"
+    "Choose options below 👇"
+)
+
+
+def _build_status(length, flags):
+    view = {name: bool(flags & bit) for name, bit in TOGGLES.items()}
+    view["length"] = length
+    return STATUS_TMPL.format_map(view)
+
+
+# pre-rendered HTML for every panel state, same keys as KEYBOARDS
+STATUS_HTML = {key: _build_status(*key) for key in KEYBOARDS}
 
 
 def status(settings):
-    return (
-        "🔐 *Password Generator*\n\n"
-        f"*Length:* {settings['length']}\n"
-        f"*Upper:* {settings['upper']}\n"
-        f"*Lower:* {settings['lower']}\n"
-        f"*Digits:* {settings['digits']}\n"
-        f"*Symbols:* {settings['symbols']}\n\n"
-        "Choose options below 👇"
-    )
+    return STATUS_HTML[panel_state(settings)]
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user = update.effective_user.id
-    s = settings_of(user)
+    s = settings_of(context.user_data)
     await update.message.reply_text(
         status(s),
         reply_markup=keyboard(s),
-        parse_mode="Markdown",
+        parse_mode="HTML",
     )
 
 
-async def callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-    user = query.from_user.id
-    s = settings_of(user)
-    data = query.data
-
-    if data.startswith("len:"):
-        s["length"] = int(data.split(":")[1])
-
-    elif data.startswith("toggle:"):
-        key = data.split(":")[1]
-        s[key] = not s[key]
-
-    elif data == "do:gen":
-        pwd = pw_gen(s["length"], s["upper"], s["lower"], s["digits"], s["symbols"])
-        s["last"] = pwd
-        await query.message.reply_text(f"`{pwd}`", parse_mode="Markdown")
-
-    elif data == "do:regen":
-        if not s["last"]:
-            pwd = pw_gen(s["length"], s["upper"], s["lower"], s["digits"], s["symbols"])
-        else:
-            pwd = pw_gen(s["length"], s["upper"], s["lower"], s["digits"], s["symbols"])
-        s["last"] = pwd
-        await query.message.reply_text(f"`{pwd}`", parse_mode="Markdown")
+async def on_len(arg, query, s):
+    if arg.isdigit() and int(arg) in LENGTHS:
+        s.length = int(arg)
+
+
+async def on_toggle(arg, query, s):
+    s.flags ^= TOGGLES.get(arg, 0)
+
+
+async def do_gen(query, s):
+    pwd = pw_gen(s.length, s.flags)
+    s.last = pwd
+    await query.message.reply_text(f"<code>{escape(pwd)}</code>", parse_mode="HTML")
+
+
+ACTIONS = {"gen": do_gen, "regen": do_gen}
+
+
+async def on_do(arg, query, s):
+    action = ACTIONS.get(arg)
+    if action:
+        await action(query, s)
+
+
+PREFIXES = {"len": on_len, "toggle": on_toggle, "do": on_do}
+
+
+async def respond(query, s):
+    before = panel_state(s)
+
+    prefix, _, arg = query.data.partition(":")
+    handler = PREFIXES.get(prefix)
+    if handler:
+        await handler(arg, query, s)
+
+    # nothing on the panel changed, skip the round-trip (Telegram would
+    # reject an identical edit with "message is not modified" anyway)
+    if panel_state(s) == before:
+        return
 
     await query.edit_message_text(
         status(s),
         reply_markup=keyboard(s),
-        parse_mode="Markdown",
+        parse_mode="HTML",
     )
 
 
+async def callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    s = settings_of(context.user_data)
+
+    # answer() and the reply/edit are independent requests; overlap them
+    # and let both finish before surfacing an error from either
+    results = await asyncio.gather(
+        query.answer(), respond(query, s), return_exceptions=True
+    )
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+
+
 async def help_cmd(update: Update, ctx):
     await update.message.reply_text("Use /start to begin.")
 
 
 def main():
-    app = Application.builder().token(TOKEN).build()
+    app = (
+        Application.builder()
+        .token(get_token())
+        .persistence(PicklePersistence(filepath=STATE_FILE))
+        .build()
+    )
 
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("help", help_cmd))